@@ -1,10 +1,16 @@
-import json
-import re
+import functools
+import hashlib
+import os
+import sys
 from pathlib import Path
-from typing import Dict, List, Set, Any
-
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse, FileResponse
+from typing import Dict, FrozenSet, List, Tuple
+
+import brotli
+import msgspec
+import numpy as np
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI, Response
+from fastapi.responses import HTMLResponse, FileResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from fastapi.staticfiles import StaticFiles
@@ -14,7 +20,11 @@ from pydantic import BaseModel, Field
 BASE_DIR = Path(__file__).parent
 DATA_PATH = BASE_DIR / "data" / "world_data.json"
 
-app = FastAPI(title="World Languages Map (Natural Earth full coverage)")
+app = FastAPI(
+    title="World Languages Map (Natural Earth full coverage)",
+    default_response_class=ORJSONResponse,
+)
+app.add_middleware(BrotliMiddleware, quality=5, minimum_size=1024)
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
 STATIC_DIR = BASE_DIR / "static"
@@ -22,37 +32,136 @@ STATIC_DIR.mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
+# Апострофы выбрасываем целиком; split() без аргументов сам схлопывает пробелы.
+_APOS = str.maketrans("", "", "'’`")
+
+
 def norm_text(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = re.sub(r"[’'`]", "", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    return " ".join((s or "").translate(_APOS).lower().split())
+
+
+# Типизированные структуры вместо словарей: msgspec парсит JSON сразу в
+# C-объекты, а доступ к полям в горячем пути — обычный атрибут.
+class Country(msgspec.Struct):
+    name: str
+    iso_a3: str
+    iso_a2: str = ""
+    official_languages: List[str] = []
+    speakers_by_language: Dict[str, int] = {}
+    population: int = 0
 
 
-def load_world_data() -> Dict[str, Any]:
+class World(msgspec.Struct):
+    countries_by_iso_a3: Dict[str, Country]
+
+
+def load_world_data() -> World:
     if not DATA_PATH.exists():
         raise FileNotFoundError(
             f"Missing {DATA_PATH}. Run: python scripts/generate_world_data.py"
         )
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if "countries_by_iso_a3" not in data:
-        raise ValueError("world_data.json has unexpected schema (missing countries_by_iso_a3).")
-    return data
+    try:
+        return msgspec.json.decode(DATA_PATH.read_bytes(), type=World)
+    except msgspec.ValidationError as e:
+        raise ValueError(f"world_data.json has unexpected schema: {e}") from e
 
 
 WORLD_DATA = load_world_data()
-COUNTRIES: Dict[str, Dict[str, Any]] = WORLD_DATA["countries_by_iso_a3"]
+COUNTRIES: Dict[str, Country] = WORLD_DATA.countries_by_iso_a3
 
-# language_norm -> set(iso_a3)
-LANG_TO_ISO3: Dict[str, Set[str]] = {}
+# language_norm -> frozenset(iso_a3); строится как set, замораживается ниже.
+LANG_TO_ISO3: Dict[str, FrozenSet[str]] = {}
+# iso_a3 -> {language_norm: speakers}. Ключи нормализуем один раз при
+# старте, чтобы coverage() находил язык независимо от регистра/пробелов.
+SPEAKERS_NORM: Dict[str, Dict[str, int]] = {}
 for iso3, c in COUNTRIES.items():
-    langs = c.get("official_languages") or []
-    if isinstance(langs, str):
-        langs = [langs]
-    for lang in langs:
+    # Интернируем строки: "English" из двух сотен стран — один объект вместо
+    # двух сотен копий, а сравнение ключей на горячем пути — по указателю.
+    c.official_languages = [sys.intern(lang) for lang in c.official_languages]
+    c.speakers_by_language = {
+        sys.intern(k): v for k, v in c.speakers_by_language.items()
+    }
+    for lang in c.official_languages:
         if lang:
-            LANG_TO_ISO3.setdefault(norm_text(lang), set()).add(iso3)
+            LANG_TO_ISO3.setdefault(sys.intern(norm_text(lang)), set()).add(iso3)
+    SPEAKERS_NORM[iso3] = {
+        sys.intern(norm_text(k)): v for k, v in c.speakers_by_language.items()
+    }
+
+# Замораживаем наборы стран: дальше они только читаются.
+LANG_TO_ISO3 = {k: frozenset(v) for k, v in LANG_TO_ISO3.items()}
+
+# Сайдкар с производными массивами: чтобы каждый воркер gunicorn не
+# перестраивал матрицу покрытия заново, кэшируем её в npz рядом с JSON,
+# ключуя по (mtime_ns, size) исходного файла.
+CACHE_PATH = BASE_DIR / "data" / "world_data.cache.npz"
+_stat = DATA_PATH.stat()
+_CACHE_KEY = np.array([_stat.st_mtime_ns, _stat.st_size], dtype=np.int64)
+
+
+def _load_array_cache():
+    try:
+        with np.load(CACHE_PATH) as npz:
+            if np.array_equal(npz["key"], _CACHE_KEY):
+                return npz["lang_keys"], npz["iso"], npz["pop"], npz["matrix"]
+    except Exception:
+        # Кэш best-effort: битый/обрезанный файл (BadZipFile, EOFError, ...)
+        # не должен мешать старту — просто перестраиваем массивы из JSON.
+        pass
+    return None
+
+
+# Матричное ядро покрытия: строка — язык, столбец — страна (ISO-коды в
+# отсортированном порядке, чтобы маска сразу давала сортированный ответ).
+# Выбор строк + any(axis=0) считает покрытие одним векторным проходом.
+_cached = _load_array_cache()
+if _cached is not None:
+    _lang_keys, ISO_ARR, POP, LANG_MATRIX = _cached
+    LANG_ID: Dict[str, int] = {ln: i for i, ln in enumerate(_lang_keys.tolist())}
+    ISO_ID: Dict[str, int] = {iso3: i for i, iso3 in enumerate(ISO_ARR.tolist())}
+else:
+    LANG_ID = {ln: i for i, ln in enumerate(LANG_TO_ISO3)}
+    ISO_ID = {iso3: i for i, iso3 in enumerate(sorted(COUNTRIES))}
+    ISO_ARR = np.array(list(ISO_ID))
+    POP = np.array([COUNTRIES[iso3].population for iso3 in ISO_ID], dtype=np.int64)
+    LANG_MATRIX = np.zeros((len(LANG_ID), len(ISO_ID)), dtype=bool)
+    for ln, iso3s in LANG_TO_ISO3.items():
+        LANG_MATRIX[LANG_ID[ln], [ISO_ID[iso3] for iso3 in iso3s]] = True
+    # Пишем во временный файл и атомарно переименовываем: параллельно
+    # стартующие воркеры не перемешают записи, а оборванная запись не
+    # оставит после себя битый world_data.cache.npz.
+    _tmp_path = CACHE_PATH.with_name(f"{CACHE_PATH.name}.{os.getpid()}.tmp.npz")
+    try:
+        np.savez(
+            _tmp_path,
+            key=_CACHE_KEY,
+            lang_keys=np.array(list(LANG_ID)),
+            iso=ISO_ARR,
+            pop=POP,
+            matrix=LANG_MATRIX,
+        )
+        os.replace(_tmp_path, CACHE_PATH)
+    except OSError:
+        # Файловая система может быть read-only (контейнер) — кэш опционален.
+        try:
+            _tmp_path.unlink()
+        except OSError:
+            pass
+
+# Данные между деплоями не меняются — сериализуем ответ
+# /api/country_info один раз при старте, а не на каждый запрос.
+_COUNTRY_INFO_PAYLOAD = msgspec.json.encode({"countries_by_iso_a3": COUNTRIES})
+_COUNTRY_INFO_ETAG = '"{}"'.format(hashlib.sha256(_COUNTRY_INFO_PAYLOAD).hexdigest())
+# Статичный payload жмём один раз при старте максимальным качеством;
+# онлайн-middleware для этого эндпоинта тогда вообще не работает.
+_COUNTRY_INFO_PAYLOAD_BR = brotli.compress(_COUNTRY_INFO_PAYLOAD, quality=11)
+
+# Все официальные языки всех стран. COUNTRIES после загрузки не меняется,
+# поэтому сортированный список считаем один раз, а не на каждый GET /.
+ALL_LANGS_SORTED: List[str] = sorted(
+    {l for c in COUNTRIES.values() for l in c.official_languages if l},
+    key=str.lower,
+)
 
 
 class CoverageRequest(BaseModel):
@@ -61,21 +170,9 @@ class CoverageRequest(BaseModel):
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
-    # Все официальные языки всех стран
-    all_langs: Set[str] = set()
-    for c in COUNTRIES.values():
-        langs = c.get("official_languages") or []
-        if isinstance(langs, str):
-            langs = [langs]
-        for l in langs:
-            if l:
-                all_langs.add(l)
-
-    known_languages = sorted(all_langs, key=lambda x: x.lower())
-
     return templates.TemplateResponse(
         "index.html",
-        {"request": request, "known_languages": known_languages},
+        {"request": request, "known_languages": ALL_LANGS_SORTED},
     )
 
 
@@ -120,43 +217,62 @@ def android_512():
 
 
 @app.get("/api/country_info")
-def country_info():
+def country_info(request: Request):
     """
-    Возвращает все страны по ISO_A3.
+    Возвращает все страны по ISO_A3. Данные статичны, поэтому отдаём
+    304, если клиент уже держит актуальную версию в кэше.
     """
-    return {"countries_by_iso_a3": COUNTRIES}
+    if request.headers.get("if-none-match") == _COUNTRY_INFO_ETAG:
+        return Response(status_code=304, headers={"ETag": _COUNTRY_INFO_ETAG})
+    headers = {
+        "ETag": _COUNTRY_INFO_ETAG,
+        "Cache-Control": "public, max-age=86400",
+        "Vary": "Accept-Encoding",
+    }
+    if "br" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "br"
+        body = _COUNTRY_INFO_PAYLOAD_BR
+    else:
+        body = _COUNTRY_INFO_PAYLOAD
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Покрытие — чистая функция от множества нормализованных языков, а в UI
+# одни и те же выборки повторяются постоянно, поэтому кэшируем результат.
+@functools.lru_cache(maxsize=4096)
+def _coverage_impl(norms: FrozenSet[str]) -> Tuple[Tuple[str, ...], int, int]:
+    sel = [LANG_ID[ln] for ln in norms if ln in LANG_ID]
+    if not sel:
+        return (), 0, 0
+
+    mask = LANG_MATRIX[sel].any(axis=0)
+    covered_iso3 = tuple(ISO_ARR[mask].tolist())
+    covered_population = int(POP[mask].sum())
+
+    # Суммарно говорящих по выбранным языкам в покрытых странах.
+    # Идём от (немногих) выбранных языков, а не по всем покрытым странам.
+    covered_speakers = 0
+    for ln in norms:
+        for iso3 in LANG_TO_ISO3.get(ln, ()):
+            covered_speakers += SPEAKERS_NORM[iso3].get(ln, 0)
+
+    return covered_iso3, covered_population, covered_speakers
 
 
 @app.post("/api/coverage")
 def coverage(payload: CoverageRequest):
     langs = [x.strip() for x in (payload.languages or []) if x and x.strip()]
     lang_norms = [norm_text(x) for x in langs]
+    unknown = [raw for raw, ln in zip(langs, lang_norms) if ln not in LANG_ID]
 
-    covered_iso3: Set[str] = set()
-    unknown: List[str] = []
-
-    for raw, ln in zip(langs, lang_norms):
-        iso3s = LANG_TO_ISO3.get(ln)
-        if iso3s:
-            covered_iso3.update(iso3s)
-        else:
-            unknown.append(raw)
-
-    covered_population = sum(int(COUNTRIES[i].get("population", 0)) for i in covered_iso3)
-
-    # Суммарно говорящих по выбранным языкам в покрытых странах
-    covered_speakers = 0
-    for iso3 in covered_iso3:
-        c = COUNTRIES.get(iso3, {})
-        speakers_by_language = c.get("speakers_by_language") or {}
-        # суммируем только по тем языкам, которые выбрал пользователь
-        for raw in langs:
-            covered_speakers += int(speakers_by_language.get(raw, 0))
+    covered_iso3, covered_population, covered_speakers = _coverage_impl(
+        frozenset(lang_norms)
+    )
 
     return {
         "input_languages": langs,
         "unknown_languages": unknown,
-        "covered_iso_a3": sorted(covered_iso3),
+        "covered_iso_a3": covered_iso3,
         "covered_count": len(covered_iso3),
         "covered_population": covered_population,
         "covered_speakers_in_countries": covered_speakers,